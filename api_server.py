@@ -1,9 +1,9 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify
 import os
 import json
-import io
 import song_manager
 from flask_cors import CORS
+from waitress import serve
 
 app = Flask(__name__)
 CORS(app)
@@ -43,12 +43,11 @@ def play_song():
     if not song_history:
         return jsonify({"error": "No song loaded"}), 400
     song = song_history[-1]
-    wav_bytes = song.render_wav()
-    return send_file(
-        io.BytesIO(wav_bytes),
+    # Unchanged tracks come from their render cache, so replays only re-mix
+    return Response(
+        song.stream_wav(),
         mimetype="audio/wav",
-        as_attachment=False,
-        download_name="song.wav"
+        headers={"Content-Disposition": "inline; filename=song.wav"}
     )
 
 @app.route("/llm_edit_song", methods=["POST"])
@@ -59,9 +58,10 @@ def llm_edit_song():
     song = song_history[-1]
     song_data = song.save_song()
     new_song = song_manager.llm_edit_song(song_data, prompt)
+    new_song.reuse_renders(song)
     song_history.append(new_song)
     new_song_data = new_song.save_song()
     return jsonify(new_song_data)
 
 if __name__ == "__main__":
-    app.run(port=5050, debug=True)
\ No newline at end of file
+    serve(app, port=5050, threads=8)
\ No newline at end of file
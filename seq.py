@@ -1,15 +1,26 @@
 import math
+import struct
+import threading
 import wave
 from dataclasses import dataclass, field
 import re
+from functools import lru_cache
 from typing import List
 import numpy as np
 import uuid
 import sounddevice as sd
 from scipy.io import wavfile
 import json
-import io
-import soundfile as sf
+from scipy.signal import sawtooth as _sp_saw, square as _sp_sq
+
+try:
+    from synth_kernels import render_events as render_events_nb
+except ImportError:  # numba not installed: fall back to the NumPy render loop
+    render_events_nb = None
+
+# numba's default threading layers are not safe to enter from several threads at once,
+# and the kernel already uses every core, so concurrent renders take turns
+_render_lock = threading.Lock()
 
 Note = str | float
 Event = tuple[Note, float]
@@ -18,23 +29,35 @@ A4 = 440.0
 NOTE_NAMES = ['C','C#','D','D#','E','F','F#','G','G#','A','A#','B']
 FLAT_TO_SHARP = {'DB':'C#','EB':'D#','GB':'F#','AB':'G#','BB':'A#'}
 SAMPLE_RATE = 44100
+WAVEFORMS = ("sine", "square", "triangle", "saw")
 
 note_re = re.compile(r'^([A-Ga-g])([#B]?)(-?\d+)$')
 
+# Harmonic numbers (as a column) for the band-limited additive saw in _osc
+SAW_K = np.arange(1, 15, dtype=np.float32).reshape(-1, 1)
+SAW_INV_K = 1.0 / SAW_K
+
 
 def load_wav(filename):
+    # Decoded samples are shared between every track using the same file, so they are read-only
+    return _load_wav_cached(filename)
+
+@lru_cache(maxsize=64)
+def _load_wav_cached(filename):
     sr, audio = wavfile.read(filename)
     if audio.dtype == np.int16:
-        audio = audio.astype(np.float32) / 32767
+        audio = np.multiply(audio, np.float32(1/32767), dtype=np.float32)
     elif audio.dtype == np.int32:
-        audio = audio.astype(np.float32) / (2 ** 23)
+        audio = np.multiply(audio, np.float32(1/2**23), dtype=np.float32)
     elif audio.dtype == np.uint8:
-        audio = (audio.astype(np.float32) - 128) / 128
+        audio = np.subtract(audio, 128, dtype=np.float32)
+        audio *= np.float32(1/128)
     if audio.ndim == 2:
-        audio = audio.mean(axis=1)
+        audio = audio.mean(axis=1, dtype=np.float32)
+    audio.setflags(write=False)
     return audio, sr
 
-def note_to_freq(note: str) -> float:
+def _note_to_freq_slow(note: str) -> float:
     n = note.strip().upper()
     m = note_re.match(n)
     if not m:
@@ -47,11 +70,19 @@ def note_to_freq(note: str) -> float:
     semi = NOTE_NAMES.index(name) - NOTE_NAMES.index('A') + (octave - 4) * 12
     return A4 * (2 ** (semi/12))
 
+# Every sharp/flat note name in octaves -1..9, keyed the way note_to_freq normalizes input
+NOTE_FREQ_TABLE = {f"{name}{octave}": _note_to_freq_slow(f"{name}{octave}")
+                   for name in NOTE_NAMES + list(FLAT_TO_SHARP) for octave in range(-1, 10)}
+
+def note_to_freq(note: str) -> float:
+    freq = NOTE_FREQ_TABLE.get(note.strip().upper())
+    return freq if freq is not None else _note_to_freq_slow(note)
+
 def parse_note(n: Note) -> float:
     return float(n) if isinstance(n, (int, float)) else note_to_freq(n)
 
 class SynthConfig:
-    def __init__(self, sample_rate=SAMPLE_RATE, bpm=120, volume=0.5, waveform="sine", attack=0.01, decay=0.05, sustain=0.8, release=0.05):
+    def __init__(self, sample_rate=SAMPLE_RATE, bpm=120, volume=0.5, waveform="sine", attack=0.01, decay=0.05, sustain=0.8, release=0.05, antialias=True):
         self.id = str(uuid.uuid4())
         self.sample_rate = sample_rate
         self.bpm = bpm
@@ -61,43 +92,96 @@ class SynthConfig:
         self.decay = decay
         self.sustain = sustain
         self.release = release
+        # False trades the band-limited saw for SciPy's cheaper (aliasing) saw/square
+        self.antialias = antialias
     
     def _get_id(self):
         return self.id
     
 
 def _envelope(n, sr, a, d, s, r):
+    # Sustain is quantized so near-identical configs share a cache entry
+    return _envelope_cached(n, int(a*sr), int(d*sr), int(r*sr), round(s, 4))
+
+@lru_cache(maxsize=256)
+def _envelope_cached(n, A, D, R, s):
     env = np.ones(n, dtype=np.float32)
-    A, D, R = int(a*sr), int(d*sr), int(r*sr)
     S = max(0, n-(A+D+R))
     if A: env[:A] = np.linspace(0, 1, A, endpoint=False)
     if D: env[A:A+D] = np.linspace(1, s, D, endpoint=False)
     if S: env[A+D:A+D+S] = s 
     if R: env[A+D+S:A+D+S+R] = np.linspace(s, 0, R, endpoint=True)
+    env.setflags(write=False)  # shared between calls, must not be modified
     return env
 
-def _osc(waveform, freq, t):
-    if freq <= 0: return np.zeros_like(t, dtype=np.float32)
-    w = 2*np.pi*freq*t
+def _osc(waveform, freq, w, antialias=True):
+    # w is the phase in radians, i.e. 2*pi*freq*t plus any starting phase
+    if freq <= 0: return np.zeros_like(w, dtype=np.float32)
     if waveform == "sine": return np.sin(w)
+    if not antialias:
+        if waveform == "square": return _sp_sq(w).astype(np.float32, copy=False)
+        if waveform == "saw": return _sp_saw(w).astype(np.float32, copy=False)
     if waveform == "square": return np.sign(np.sin(w))
     if waveform == "triangle": return 2/np.pi*np.arcsin(np.sin(w))
     if waveform == "saw":
-        y = np.zeros_like(t)
-        for k in range(1, 15): y += (1.0/k)*np.sin(2*np.pi*k*freq*t)
-        return (2/np.pi)*y
+        # (K, N) phase matrix -> a single np.sin call over all harmonics
+        phases = SAW_K * w[np.newaxis, :]
+        return (2/np.pi)*(SAW_INV_K*np.sin(phases)).sum(axis=0)
     return np.sin(w)
 
+# One period of every (waveform, antialias) shape. Their harmonic content does not depend
+# on pitch, so each table serves every note and is read at the note's phase.
+WAVETABLE_SIZE = 4096
+WAVETABLES = {(wf, aa): _osc(wf, 1.0, 2*np.pi*np.arange(WAVETABLE_SIZE)/WAVETABLE_SIZE, aa).astype(np.float32)
+              for wf in WAVEFORMS for aa in (True, False)}
+
+def _wavetable_osc(table, w):
+    # Linear interpolation into a single-period table; w is the (non-negative) phase in radians
+    idx = w * (WAVETABLE_SIZE/(2*np.pi))
+    i0 = idx.astype(np.int64)
+    frac = idx - i0
+    i = i0 & (WAVETABLE_SIZE-1)
+    lo = table[i]
+    return lo + frac*(table[(i+1) & (WAVETABLE_SIZE-1)] - lo)
+
 class Track:
     def __init__(self, name: str, cfg: SynthConfig, events=None, gain=1.0):
         self.name = name
-        self.events = [] if events is None else list(events)
+        self.events = []
         self.cfg = cfg
         self.gain = gain
+        # Struct-of-arrays view of self.events, filled in by add(). Chord notes are
+        # flattened into _chord_freqs; event i plays _chord_freqs[_chord_offsets[i]:_chord_offsets[i+1]].
+        # _phases holds each note's starting phase, taken from the song timeline so that
+        # back-to-back notes of the same pitch continue the waveform without a click.
+        self._chord_freqs, self._phases, self._chord_offsets = [], [], [0]
+        self._starts_samples, self._ns = [], []
+        self._arrays = None
+        self._dirty = True
+        self._rendered_buf = None
+        # Bumped on every edit; unlike _dirty it is not reset by rendering
+        self._version = 0
+        for note, start, duration in ([] if events is None else events):
+            self.add(note, start, duration)
     
     def add(self, note, start, duration):
         self.events.append((note, start, duration))
+        self._index_event(note, start, duration)
+        self._arrays = None
+        self._dirty = True
+        self._version += 1
         return self
+
+    def _index_event(self, note, start, duration):
+        sr, spb = self.cfg.sample_rate, 60/self.cfg.bpm
+        notes = note.split('+') if isinstance(note, str) and "+" in note else [note]
+        freqs = [parse_note(x) for x in notes]
+        start_idx = int(start * spb * sr)
+        self._chord_freqs.extend(freqs)
+        self._phases.extend(2*np.pi*((f*start_idx/sr) % 1.0) for f in freqs)
+        self._chord_offsets.append(len(self._chord_freqs))
+        self._starts_samples.append(start_idx)
+        self._ns.append(int(duration * spb * sr))
     
     def _get_events(self):
         if self.events ==[]:
@@ -114,57 +198,131 @@ class Track:
             "events": self.events,
             "gain": self.gain
         }
+
+    def _same_content(self, other):
+        # Same events, gain and synth settings, ignoring the config's generated id
+        cfg_vars = lambda cfg: {k: v for k, v in vars(cfg).items() if k != "id"}
+        return (type(self) is type(other) and self.events == other.events
+                and self.gain == other.gain and cfg_vars(self.cfg) == cfg_vars(other.cfg))
     
-    def render(self):
+    def _wavetable(self):
+        # Unknown waveform names play as sine, like _osc
+        return WAVETABLES.get((self.cfg.waveform, self.cfg.antialias), WAVETABLES[("sine", True)])
+
+    def _event_arrays(self):
+        if self._arrays is None:
+            self._arrays = (np.array(self._chord_freqs, dtype=np.float64),
+                            np.array(self._phases, dtype=np.float64),
+                            np.array(self._chord_offsets, dtype=np.int32),
+                            np.array(self._starts_samples, dtype=np.int32),
+                            np.array(self._ns, dtype=np.int32))
+        return self._arrays
+
+    def _render_events(self, buf):
+        # NumPy reference path, used when numba is not available
+        sr = self.cfg.sample_rate
+        freqs, phases, chord_offsets, starts, ns = self._event_arrays()
+        table = self._wavetable()
+        # Time axis, phase and output scratch are sized to the longest event and reused for every note
+        max_n = ns.max() if len(ns) else 0
+        t_buf = np.arange(max_n) / sr
+        phase_buf = np.empty(max_n)
+        scratch = np.empty(max_n, dtype=np.float32)
+        for i in range(len(starts)):
+            n, start_idx = ns[i], starts[i]
+            lo, hi = chord_offsets[i], chord_offsets[i+1]
+            # Accumulate chord notes into one buffer instead of averaging a list of arrays
+            y = scratch[:n]
+            y.fill(0)
+            for c in range(lo, hi):
+                if freqs[c] <= 0:
+                    continue
+                w = np.multiply(t_buf[:n], 2*np.pi*freqs[c], out=phase_buf[:n])
+                w += phases[c]
+                y += _wavetable_osc(table, w)
+            if hi - lo > 1:
+                y *= 1.0/(hi - lo)
+            env = _envelope(n, sr, self.cfg.attack, self.cfg.decay, self.cfg.sustain, self.cfg.release)
+            np.multiply(y, env, out=y)
+            y *= self.gain
+            buf[start_idx:start_idx + n] += y
+
+    def _num_samples(self):
         sr, spb = self.cfg.sample_rate, 60/self.cfg.bpm
         # Find the end of the last note
         total_beats = max((start + dur) for _, start, dur in self.events) if self.events else 0
-        total_sec = total_beats * spb
-        buf = np.zeros(int(total_sec * sr), dtype=np.float32)
-        for note, start, dur in self.events:
-            n = int(dur * spb * sr)
-            t = np.arange(n) / sr
-            if isinstance(note, str) and "+" in note:
-                y = np.mean([_osc(self.cfg.waveform, parse_note(x), t) for x in note.split('+')], axis=0)
-            else:
-                y = _osc(self.cfg.waveform, parse_note(note), t)
-            y *= _envelope(n, sr, self.cfg.attack, self.cfg.decay, self.cfg.sustain, self.cfg.release)
-            start_idx = int(start * spb * sr)
-            end_idx = start_idx + n
-            buf[start_idx:end_idx] += y * self.gain
-        mx = float(np.max(np.abs(buf)))
-        if mx > 0:
-            buf /= mx
-        return buf * self.cfg.volume
+        return int(total_beats * spb * sr)
+
+    def render(self):
+        if not self._dirty and self._rendered_buf is not None:
+            return self._rendered_buf
+        sr = self.cfg.sample_rate
+        buf = np.zeros(self._num_samples(), dtype=np.float32)
+        if render_events_nb is not None:
+            freqs, phases, chord_offsets, starts, ns = self._event_arrays()
+            with _render_lock:
+                render_events_nb(self._wavetable(), freqs, phases, chord_offsets, starts, ns, sr,
+                                 self.cfg.attack, self.cfg.decay, self.cfg.sustain, self.cfg.release,
+                                 self.gain, buf)
+        else:
+            self._render_events(buf)
+        return self._cache_render(self._normalize(buf))
+
+    def _normalize(self, buf):
+        # Peak-normalize and apply the track volume in a single in-place pass
+        mx = float(np.max(np.abs(buf))) if len(buf) else 0.0
+        buf *= self.cfg.volume / mx if mx > 0 else self.cfg.volume
+        return buf
+
+    def _cache_render(self, buf):
+        buf.setflags(write=False)  # handed out on every later render() call
+        self._rendered_buf = buf
+        self._dirty = False
+        return buf
 
 class WavTrack(Track):
     def __init__(self, name, cfg, sample_path, events=None, gain=1.0):
         super().__init__(name, cfg, events, gain)
+        self.sample_path = sample_path
         self.sample, _ = load_wav(sample_path)
 
-    def render(self):
+    def _index_event(self, note, start, duration):
+        # Sample hits have no pitch or length of their own, only a start sample
         sr, spb = self.cfg.sample_rate, 60/self.cfg.bpm
-        total_beats = max((start + dur) for _, start, dur in self.events) if self.events else 0
-        total_sec = total_beats * spb
-        buf = np.zeros(int(total_sec * sr), dtype=np.float32)
-        for note, start, duration in self.events:
-            #if note != self.name:
-                #continue  # Only play this track's sample
-            start_idx = int(start * spb * sr)
-            end_idx = start_idx + len(self.sample)
-            if end_idx > len(buf):
-                end_idx = len(buf)
-            buf[start_idx:end_idx] += self.sample[:end_idx - start_idx] * self.gain
-        mx = float(np.max(np.abs(buf)))
-        if mx > 0:
-            buf /= mx
-        return buf * self.cfg.volume      
+        self._starts_samples.append(int(start * spb * sr))
+
+    def _same_content(self, other):
+        # A different sample file renders differently even with identical hits
+        return super()._same_content(other) and self.sample_path == other.sample_path
+
+    def render(self):
+        if not self._dirty and self._rendered_buf is not None:
+            return self._rendered_buf
+        buf = np.zeros(self._num_samples(), dtype=np.float32)
+        # Scale the sample once and clip every hit's end index up front; each hit is then
+        # a single in-place slice add with no per-hit temporaries
+        hit = self.sample * np.float32(self.gain)
+        starts = np.array(self._starts_samples, dtype=np.int64)
+        ends = np.minimum(starts + len(hit), len(buf))
+        for start_idx, end_idx in zip(starts.tolist(), ends.tolist()):
+            buf[start_idx:end_idx] += hit[:end_idx - start_idx]
+        return self._cache_render(self._normalize(buf))
     
+def wav_header(num_frames, sample_rate, channels=1, sampwidth=2):
+    # Canonical 44-byte PCM WAV header, so audio can be streamed without an encoder
+    data_size = num_frames * channels * sampwidth
+    return struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + data_size, b'WAVE',
+                       b'fmt ', 16, 1, channels, sample_rate, sample_rate * channels * sampwidth,
+                       channels * sampwidth, sampwidth * 8, b'data', data_size)
+
 class Song:
     def __init__(self, cfg: SynthConfig, tracks=None, samples={}):
         self.tracks = [] if tracks is None else list(tracks)
         self.cfg = cfg
         self.samples = samples
+        # save_song() output, reused while _tracks_key() is unchanged
+        self._serialized_cache = None
+        self._serialized_key = None
     
     def add_track(self, t: Track): 
         self.tracks.append(t)
@@ -174,13 +332,28 @@ class Song:
         self.tracks.extend(t)
         return self
 
+    def _tracks_key(self):
+        # Changes whenever a track is added or any track is edited
+        return tuple((id(t), t._version) for t in self.tracks)
+
+    def reuse_renders(self, previous):
+        # Carry over cached renders of tracks left unchanged since the previous version
+        prev_tracks = {t.name: t for t in previous.tracks}
+        for t in self.tracks:
+            prev = prev_tracks.get(t.name)
+            if prev is not None and not prev._dirty and prev._rendered_buf is not None and t._same_content(prev):
+                t._rendered_buf = prev._rendered_buf
+                t._dirty = False
+        return self
+
     def mixdown(self):
         if not self.tracks:
             return np.zeros(1, dtype=np.float32)
-        bufs = [t.render() for t in self.tracks]
-        n = max(len(b) for b in bufs)
-        mix = np.zeros(n, dtype=np.float32)
-        for b in bufs: 
+        # Size the mix up front and add each track's render straight into it.
+        # render() returns the cached buffer for tracks not edited since their last render.
+        mix = np.zeros(max(t._num_samples() for t in self.tracks), dtype=np.float32)
+        for t in self.tracks:
+            b = t.render()
             mix[:len(b)] += b
         mx = float(np.max(np.abs(mix)))
         if mx > 1.0:
@@ -192,22 +365,37 @@ class Song:
         sd.play(audio, self.cfg.sample_rate)
         sd.wait()
     
+    def _mixdown_i16(self):
+        # Scale and clip the float mix in place, then quantize to 16-bit PCM once
+        mix = self.mixdown()
+        np.multiply(mix, 32767, out=mix)
+        np.clip(mix, -32768, 32767, out=mix)
+        return mix.astype(np.int16)
+
     def render_wav(self):
-        audio = self.mixdown()
-        buf = io.BytesIO()
-        sf.write(buf, audio, self.cfg.sample_rate, format='WAV')
-        buf.seek(0)
-        return buf.read()
+        audio = self._mixdown_i16()
+        return wav_header(len(audio), self.cfg.sample_rate) + audio.tobytes()
+
+    def stream_wav(self, chunk_frames=65536):
+        # Yields the WAV header then the PCM data in chunks, without building the whole file
+        audio = self._mixdown_i16()
+        yield wav_header(len(audio), self.cfg.sample_rate)
+        for i in range(0, len(audio), chunk_frames):
+            yield audio[i:i + chunk_frames].tobytes()
 
     def write_wav(self, path):
-        audio = self.mixdown()
+        audio = self._mixdown_i16()
         with wave.open(path, "wb") as wf:
             wf.setnchannels(1)
             wf.setsampwidth(2)
             wf.setframerate(self.cfg.sample_rate)
-            wf.writeframes((audio*32767).astype(np.int16).tobytes())
+            wf.writeframes(audio.tobytes())
 
     def save_song(self):
+        # The returned dict is shared between calls and must not be modified
+        key = self._tracks_key()
+        if self._serialized_cache is not None and self._serialized_key == key:
+            return self._serialized_cache
         song_info = {"samples": self.samples}
         tracks_info = []
         cfg_set = set()
@@ -219,6 +407,8 @@ class Song:
         cfg_info = [vars(cfg) for cfg in cfg_set]
         song_info["SynthConfigs"] = cfg_info
         song_info["Tracks"] = tracks_info
+        self._serialized_cache = song_info
+        self._serialized_key = key
         return song_info
     
 def save_song(song, samples, json_path="recent_song_info.json"):
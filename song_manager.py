@@ -56,7 +56,7 @@ def llm_edit_song(song_json, instruction):
     structure_explanation = """
     
     - "samples": a dictionary mapping sample names to file paths or metadata.
-    - "SynthConfigs": a list of synth settings, each with keys like "id", "sample_rate", "bpm", "volume", "waveform", "attack", "decay", "sustain", "release".
+    - "SynthConfigs": a list of synth settings, each with keys like "id", "sample_rate", "bpm", "volume", "waveform", "attack", "decay", "sustain", "release", "antialias" (false uses cheaper, harsher saw/square waves).
     - "Tracks": a list of tracks. Each track has:
         - "name": the track name
         - "cfg_id": the id of the SynthConfig it uses (links to a SynthConfig id)
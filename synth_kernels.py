@@ -0,0 +1,65 @@
+import numpy as np
+from numba import njit, prange
+
+
+@njit(cache=True, fastmath=True, nogil=True)
+def _osc_nb(table, freq, phase, n, sr, out):
+    # Adds the oscillator, starting at phase (radians), into out[:n] so chord notes can accumulate in place.
+    # table holds one period of the waveform (len(table) a power of two) and is read with linear interpolation.
+    if freq <= 0:
+        return
+    size = len(table)
+    step = freq*size/sr
+    start = phase*(size/(2*np.pi))
+    for j in range(n):
+        idx = start + step*j
+        i = int(idx)
+        frac = idx - i
+        i &= size - 1
+        out[j] += table[i] + frac*(table[(i+1) & (size-1)] - table[i])
+
+
+@njit(cache=True, fastmath=True, nogil=True)
+def _env_nb(n, sr, a, d, s, r, out):
+    # Scales out[:n] by the same ADSR shape as seq._envelope
+    A, D, R = int(a*sr), int(d*sr), int(r*sr)
+    S = max(0, n-(A+D+R))
+    for j in range(n):
+        if j < A:
+            e = j/A
+        elif j < A+D:
+            e = 1 + (s-1)*(j-A)/D
+        elif j < A+D+S or R == 1:
+            e = s
+        else:
+            e = s*(1 - (j-A-D-S)/(R-1))
+        out[j] *= e
+
+
+@njit(cache=True, parallel=True, fastmath=True, nogil=True)
+def render_events(table, freqs, phases, chord_offsets, starts, ns, sr, a, d, s, r, gain, out):
+    """Renders every event of a synth track and adds it into out.
+
+    Event i plays freqs[chord_offsets[i]:chord_offsets[i+1]] (averaged when it
+    is a chord) from the single-period wavetable, each starting at the matching
+    entry of phases, for ns[i] samples starting at sample starts[i].
+    """
+    n_events = len(starts)
+    seg = np.zeros(n_events + 1, dtype=np.int64)
+    for i in range(n_events):
+        seg[i+1] = seg[i] + ns[i]
+    scratch = np.zeros(seg[n_events], dtype=np.float32)
+    for i in prange(n_events):
+        y = scratch[seg[i]:seg[i+1]]
+        lo, hi = chord_offsets[i], chord_offsets[i+1]
+        for c in range(lo, hi):
+            _osc_nb(table, freqs[c], phases[c], ns[i], sr, y)
+        if hi - lo > 1:
+            y *= 1.0/(hi - lo)
+        _env_nb(ns[i], sr, a, d, s, r, y)
+    # Events may overlap, so accumulate serially rather than inside prange
+    for i in range(n_events):
+        st = starts[i]
+        m = min(ns[i], len(out) - st)
+        if m > 0:
+            out[st:st+m] += gain*scratch[seg[i]:seg[i]+m]